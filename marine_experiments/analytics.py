@@ -0,0 +1,124 @@
+"""Score distributions computed over whole columns rather than row by row.
+
+Scores arrive as a binary COPY stream and are decoded straight into arrays:
+NumPy arrays when NumPy is installed, otherwise `array` module arrays. NumPy is
+imported on first use so that importing the API stays fast."""
+
+import math
+import struct
+from array import array
+
+
+PERCENTILES = (5, 25, 50, 75, 95)
+COPY_HEADER_SIZE = 19
+ROW_FORMAT = ">hiiid"
+ROW_DTYPE = [("fields", ">i2"), ("species_length", ">i4"), ("species_id", ">i4"),
+             ("score_length", ">i4"), ("score", ">f8")]
+NOT_LOADED = object()
+
+np = NOT_LOADED
+
+
+def load_numpy():
+    """Returns the numpy module, importing it on first use, or None if it is not installed."""
+    global np
+    if np is NOT_LOADED:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+
+def decode_scores(data: memoryview) -> tuple:
+    """Returns (species ids, percentage scores) arrays from a binary COPY stream.
+
+    Slicing a memoryview does not copy, so the rows are decoded straight from the
+    buffer the stream was received into."""
+    extension_length = int.from_bytes(data[15:COPY_HEADER_SIZE], "big")
+    body = data[COPY_HEADER_SIZE + extension_length:-2]
+    np = load_numpy()
+    if np is not None:
+        rows = np.frombuffer(body, dtype=ROW_DTYPE)
+        return rows["species_id"].astype(np.int64), rows["score"].astype(np.float64)
+    species_ids, scores = array("l"), array("d")
+    for _, _, species_id, _, score in struct.iter_unpack(ROW_FORMAT, body):
+        species_ids.append(species_id)
+        scores.append(score)
+    return species_ids, scores
+
+
+def percentile(sorted_scores, rank: float) -> float:
+    """Returns a percentile by linear interpolation, as numpy.percentile does."""
+    position = (len(sorted_scores) - 1) * rank / 100
+    low, high = math.floor(position), math.ceil(position)
+    return sorted_scores[low] + (sorted_scores[high] - sorted_scores[low]) * (position - low)
+
+
+def summarise(species_ids, scores, bins: int) -> tuple:
+    """Returns overall stats, the histogram, and per-species (id, count, mean, std) tuples.
+
+    Scores outside 0-100%, e.g. after a type's max_score is lowered, are counted
+    in the first or last histogram bin by both paths."""
+    np = load_numpy()
+    if np is not None:
+        mean, std = float(scores.mean()), float(scores.std())
+        percentiles = [float(p) for p in np.percentile(scores, PERCENTILES)]
+        counts, _ = np.histogram(np.clip(scores, 0, 100), bins=bins, range=(0, 100))
+        unique_ids, groups = np.unique(species_ids, return_inverse=True)
+        group_counts = np.bincount(groups)
+        group_means = np.bincount(groups, weights=scores) / group_counts
+        group_squares = np.bincount(groups, weights=scores * scores) / group_counts
+        group_stds = np.sqrt(np.maximum(group_squares - group_means ** 2, 0))
+        return mean, std, percentiles, counts.tolist(), list(zip(
+            unique_ids.tolist(), group_counts.tolist(), group_means.tolist(), group_stds.tolist()))
+
+    count = len(scores)
+    mean = math.fsum(scores) / count
+    std = math.sqrt(max(math.fsum(s * s for s in scores) / count - mean ** 2, 0))
+    sorted_scores = sorted(scores)
+    percentiles = [percentile(sorted_scores, rank) for rank in PERCENTILES]
+    counts = [0] * bins
+    groups = {}
+    for species_id, score in zip(species_ids, scores):
+        counts[min(max(int(score * bins / 100), 0), bins - 1)] += 1
+        group = groups.setdefault(species_id, [0, 0.0, 0.0])
+        group[0] += 1
+        group[1] += score
+        group[2] += score * score
+    species = []
+    for species_id in sorted(groups):
+        group_count, total, squares = groups[species_id]
+        group_mean = total / group_count
+        species.append((species_id, group_count, group_mean,
+                        math.sqrt(max(squares / group_count - group_mean ** 2, 0))))
+    return mean, std, percentiles, counts, species
+
+
+def score_distribution(data: memoryview, species_names: dict, bins: int) -> dict:
+    """Returns the distribution of percentage scores in a binary COPY stream.
+
+    Each species' z_score places its mean score within the overall distribution."""
+    species_ids, scores = decode_scores(data)
+    edges = [round(100 * i / bins, 2) for i in range(bins + 1)]
+    if len(scores) == 0:
+        return {"count": 0, "mean": None, "std": None,
+                "percentiles": {f"p{rank}": None for rank in PERCENTILES},
+                "histogram": {"edges": edges, "counts": [0] * bins}, "species": []}
+
+    mean, std, percentiles, counts, species = summarise(species_ids, scores, bins)
+    return {
+        "count": len(scores),
+        "mean": round(mean, 2),
+        "std": round(std, 2),
+        "percentiles": {f"p{rank}": round(value, 2) for rank, value in zip(PERCENTILES, percentiles)},
+        "histogram": {"edges": edges, "counts": counts},
+        "species": [{
+            "species": species_names.get(species_id),
+            "count": group_count,
+            "mean": round(group_mean, 2),
+            "std": round(group_std, 2),
+            "z_score": round((group_mean - mean) / std, 2) if std else None
+            } for species_id, group_count, group_mean, group_std in species]
+    }
@@ -1,21 +1,265 @@
 """An API for handling marine experiments."""
 
+import logging
+import os
 from datetime import datetime
+from math import ceil
+from threading import Lock
+from time import perf_counter
 
-from flask import Flask, jsonify, request
-from psycopg2 import sql
+from flask import Flask, Response, g, jsonify, request, send_file
+from psycopg2 import sql, OperationalError, InterfaceError, IntegrityError, DataError
+from psycopg2.extensions import parse_dsn
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from database_functions import get_db_connection, get_subjects, get_experiments, delete_experiment_by_id, insert_experiment
+from analytics import score_distribution
+from compression import compress_response
+from database_functions import (get_db_connection, get_subjects, get_experiments, get_experiment_rows,
+                                format_experiments, delete_experiment_by_id, get_idempotent_response,
+                                copy_score_percentages, get_species_names,
+                                insert_experiment, get_experiment_changes, get_subject_fields,
+                                get_experiment_fields, parse_fields, search_subjects, ping,
+                                db_breaker, ScoreOutOfRange, SUBJECT_COLUMNS, EXPERIMENT_COLUMNS)
+from events import EventBroadcaster, stream_events
+from facilities import (FACILITY_HEADER, FacilityPrefixMiddleware, FacilityUnavailable,
+                        facility_pools_from_env)
+from idempotency import IDEMPOTENCY_TTL, MAX_KEY_LENGTH, ResponseCache, hash_request
+from jobs import JOB_KINDS, submit_job, get_job, job_path
+from rate_limit import RateLimiter
+from resilience import CircuitOpenError, connect_with_backoff, end_transaction
+import slow_queries
+from validation import validate_experiment, warm_caches, forget_experiment_types, invalid, as_int
 
 
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+app.wsgi_app = FacilityPrefixMiddleware(app.wsgi_app)
+if TRUSTED_PROXIES:
+    # Behind a reverse proxy every request arrives from the proxy's address, so take
+    # the client address it forwards; only as many hops as are trusted are believed.
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 """
 For testing reasons; please ALWAYS use this connection. 
 - Do not make another connection in your code
 - Do not close this connection
+It is opened on first use, so importing the API never touches the database.
 """
-conn = get_db_connection("marine_experiments")
+conn = None
+DB_NAME = os.environ.get("DB_NAME", "marine_experiments")
+
+ROUTE_COSTS = {
+    ("GET", "experiment"): 10,
+    ("GET", "subject"): 5,
+    ("GET", "subject_search"): 5,
+    ("GET", "experiment_changes"): 2,
+    ("GET", "experiment_distribution"): 10,
+    ("POST", "create_job"): 5,
+    ("POST", "experiment"): 1,
+    ("DELETE", "delete_experiment"): 1,
+    ("GET", "home"): 1,
+    ("GET", "liveness"): 0,
+    ("GET", "readiness"): 0
+}
+CHANGES_PAGE_SIZE = 1000
+MAX_SEARCH_RESULTS = 50
+MAX_BATCH_REQUESTS = 20
+MAX_HISTOGRAM_BINS = 100
+BATCH_ENDPOINTS = {
+    "/subject": "subject",
+    "/subject/search": "subject_search",
+    "/experiment": "experiment"
+}
+API_KEYS = {key.strip() for key in os.environ.get("API_KEYS", "").split(",") if key.strip()}
+limiter = RateLimiter(ROUTE_COSTS, capacity=float(os.environ.get("RATE_LIMIT_CAPACITY", 100)),
+                      refill_rate=float(os.environ.get("RATE_LIMIT_REFILL", 10)))
+idempotency_cache = ResponseCache()
+HEALTH_ENDPOINTS = {"liveness", "readiness"}
+UNLOCKED_ENDPOINTS = {"liveness", "readiness", "experiment_events"}
+CONNECTION_LOCK_TIMEOUT = 30
+READINESS_LOCK_TIMEOUT = 0.5
+connection_lock = Lock()
+facility_pools = facility_pools_from_env(
+    lambda database: connect_with_backoff(lambda: get_db_connection(database)))
+facility_broadcasters = {}
+
+
+def database_name() -> str:
+    """Returns the name of the default database, following the connection if it was replaced."""
+    return parse_dsn(conn.dsn)["dbname"] if conn is not None else DB_NAME
+
+
+def get_shared_connection():
+    """Returns the shared connection, opening it on first use or after it was dropped.
+
+    Reconnects go through the circuit breaker, so while the database is down
+    requests fail fast instead of each repeating the backoff."""
+    global conn
+    if conn is None or conn.closed:
+        dbname = database_name()
+        conn = db_breaker(connect_with_backoff)(lambda: get_db_connection(dbname))
+    return conn
+
+
+broadcaster = EventBroadcaster(lambda: get_db_connection(database_name()))
+
+
+def get_conn():
+    """Returns the connection for the current request's facility, or the shared connection.
+
+    A facility connection is checked out here if select_facility did not already."""
+    facility = g.get("facility")
+    if not facility:
+        return get_shared_connection()
+    if "facility_conn" not in g:
+        g.facility_conn = facility_pools.acquire(facility)
+    return g.facility_conn
+
+
+def database_target() -> str:
+    """Returns the database name or connection string for the current request's facility."""
+    facility = g.get("facility")
+    return facility_pools.databases[facility] if facility else database_name()
+
+
+def get_broadcaster() -> EventBroadcaster:
+    """Returns the event broadcaster for the current request's facility."""
+    facility = g.get("facility")
+    if not facility:
+        return broadcaster
+    database = database_target()
+    return facility_broadcasters.setdefault(
+        facility, EventBroadcaster(lambda: get_db_connection(database)))
+
+
+def client_id() -> str:
+    """Returns who the current request is charged to.
+
+    X-API-Key is chosen by the client, so it only counts when it is one of the
+    configured API_KEYS; any other request is charged to its address."""
+    api_key = request.headers.get("X-API-Key")
+    if api_key in API_KEYS:
+        return f"key:{api_key}"
+    return f"addr:{request.remote_addr}"
+
+
+def batch_cost() -> float:
+    """Returns the cost of a batch: what its sub-requests would cost sent on their own."""
+    data = request.get_json(silent=True)
+    sub_requests = data.get("requests") if isinstance(data, dict) else None
+    if not isinstance(sub_requests, list):
+        return limiter.default_cost
+    paths = [sub.get("path") if isinstance(sub, dict) else None for sub in sub_requests]
+    return max(limiter.default_cost,
+               sum(limiter.cost_of("GET", BATCH_ENDPOINTS.get(path) if isinstance(path, str) else None)
+                   for path in paths))
+
+
+@app.before_request
+def enforce_rate_limit():
+    """Rejects clients that have spent their request budget."""
+    if request.endpoint == "batch":
+        retry_after = limiter.charge(client_id(), batch_cost())
+    else:
+        retry_after = limiter.check(client_id(), request.method, request.endpoint)
+    if retry_after:
+        return {"error": "Rate limit exceeded."}, 429, {"Retry-After": str(ceil(retry_after))}
+
+
+@app.before_request
+def ensure_connection():
+    """Takes the shared connection for this request, opening or replacing it if needed.
+
+    The connection is held under a lock until teardown, so a threaded server can
+    neither interleave two requests' statements nor roll back another request's
+    uncommitted work. Facility requests use their own pool instead."""
+    if request.endpoint in UNLOCKED_ENDPOINTS or FACILITY_HEADER in request.headers:
+        return None
+    started = perf_counter()
+    if not connection_lock.acquire(timeout=CONNECTION_LOCK_TIMEOUT):
+        return {"error": "Database temporarily unavailable."}, 503, {"Retry-After": "1"}
+    g.holds_connection = True
+    get_shared_connection()
+    g.connection_wait = perf_counter() - started
+    return None
+
+
+@app.before_request
+def select_facility():
+    """Checks out a connection to the facility named by the X-Facility header, if any.
+
+    Event streams and health checks take no connection here; readiness checks one
+    out itself so that a busy pool is reported rather than raised."""
+    facility = request.headers.get(FACILITY_HEADER)
+    if facility is None:
+        return None
+    if facility not in facility_pools.databases:
+        return {"error": f"Unknown facility '{facility}'."}, 404
+    g.facility = facility
+    if request.endpoint not in UNLOCKED_ENDPOINTS | HEALTH_ENDPOINTS:
+        started = perf_counter()
+        g.facility_conn = facility_pools.acquire(facility)
+        g.connection_wait = g.get("connection_wait", 0) + perf_counter() - started
+    return None
+
+
+@app.after_request
+def report_connection_wait(response):
+    """Reports the time spent obtaining a database connection, so load tests can see it.
+
+    This covers waiting for the shared connection's lock or a facility pool, and
+    any reconnect."""
+    if "connection_wait" in g:
+        response.headers.add("Server-Timing", f"db-conn;dur={g.connection_wait * 1000:.3f}")
+    return response
+
+
+@app.after_request
+def compress(response):
+    """Compresses responses for clients that accept it."""
+    return compress_response(response, request.accept_encodings)
+
+
+@app.teardown_request
+def close_transaction(error):
+    """Ends each request's transaction so a failure cannot poison the next request."""
+    if g.pop("holds_connection", False):
+        if conn is not None:
+            end_transaction(conn)
+        connection_lock.release()
+    facility_conn = g.pop("facility_conn", None)
+    if facility_conn is not None:
+        facility_pools.release(g.facility, facility_conn)
+    facility_pools.close_idle()
+
+
+@app.errorhandler(CircuitOpenError)
+def database_circuit_open(error):
+    """Fails fast while the database is known to be down."""
+    return {"error": "Database temporarily unavailable."}, 503, {"Retry-After": str(ceil(error.retry_after))}
+
+
+@app.errorhandler(FacilityUnavailable)
+def facility_busy(error):
+    """Reports a facility whose connection pool is exhausted."""
+    return {"error": "Facility database busy."}, 503, {"Retry-After": "1"}
+
+
+@app.errorhandler(OperationalError)
+@app.errorhandler(InterfaceError)
+def database_unavailable(error):
+    """Reports a lost database connection."""
+    return {"error": "Database temporarily unavailable."}, 503, {"Retry-After": "1"}
+
+
+@app.errorhandler(IntegrityError)
+@app.errorhandler(DataError)
+def database_rejected(error):
+    """Reports data the database refused to store."""
+    return {"error": "Request rejected by the database."}, 400
 
 
 def verify_type(type: str) -> bool:
@@ -29,24 +273,11 @@ def verify_score(score_over: str) -> bool:
         return True
     try:
         score_over = int(score_over)
-    except:
+    except ValueError:
         return False
     return  score_over >= 0 and score_over <= 100
 
 
-def verify_subject_id(subject_id: str) -> bool:
-    if not subject_id:
-        return False
-    for i in str(subject_id):
-        if i not in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"]:
-            return False
-    try:
-        subject_id = int(subject_id)
-    except:
-        return False
-    return True
-
-
 @app.get("/")
 def home():
     """Returns an informational message."""
@@ -57,61 +288,301 @@ def home():
     })
 
 
+def list_subjects(args) -> tuple:
+    """Returns the /subject response for the given query parameters."""
+    fields = args.get("fields")
+    if fields is None:
+        return get_subjects(get_conn()), 200
+    fields = parse_fields(fields, SUBJECT_COLUMNS)
+    if not fields:
+        return {"error": "Invalid value for 'fields' parameter"}, 400
+    return get_subject_fields(fields, get_conn()), 200
+
+
+def find_subjects(args) -> tuple:
+    """Returns the /subject/search response for the given query parameters."""
+    query = args.get("q", "").strip()
+    limit = as_int(args.get("limit", "10"))
+    if not 0 < len(query) <= 100:
+        return {"error": "Invalid value for 'q' parameter"}, 400
+    if limit is None or not 0 < limit <= MAX_SEARCH_RESULTS:
+        return {"error": "Invalid value for 'limit' parameter"}, 400
+    return search_subjects(query, limit, get_conn()), 200
+
+
+def list_experiments(args, experiment_rows: list[tuple] | None = None) -> tuple:
+    """Returns the GET /experiment response for the given query parameters.
+
+    If experiment_rows holds every unarchived experiment already fetched, they are
+    filtered here instead of running another query."""
+    type = args.get("type")
+    score_over = args.get("score_over")
+    include_archived = args.get("include_archived", "false").lower()
+    if not verify_type(type):
+        return {"error": "Invalid value for 'type' parameter"}, 400
+    if not verify_score(score_over):
+        return {"error": "Invalid value for 'score_over' parameter"}, 400
+    if include_archived not in ("true", "false"):
+        return {"error": "Invalid value for 'include_archived' parameter"}, 400
+    include_archived = include_archived == "true"
+    fields = args.get("fields")
+    if fields is not None:
+        fields = parse_fields(fields, EXPERIMENT_COLUMNS)
+        if not fields:
+            return {"error": "Invalid value for 'fields' parameter"}, 400
+        return get_experiment_fields(type, score_over, fields, get_conn(), include_archived), 200
+    if experiment_rows is None or include_archived:
+        return get_experiments(type, score_over, get_conn(), include_archived), 200
+    if type:
+        experiment_rows = [row for row in experiment_rows if row[4] == type.lower()]
+    if score_over:
+        experiment_rows = [row for row in experiment_rows if row[5] > int(score_over)]
+    return format_experiments(experiment_rows), 200
+
+
 @app.get("/subject")
 def subject():
     """Returns an informational message."""
-    subjects = get_subjects(conn)
-    return subjects, 200
+    return list_subjects(request.args)
+
+
+@app.get("/subject/search")
+def subject_search():
+    """Returns subjects matching a name or species, best matches first."""
+    return find_subjects(request.args)
 
 
 @app.route("/experiment", methods = ["GET", "POST"])
 def experiment():
     """Returns an informational message."""
     if request.method == "GET":
-        type = request.args.get("type")
-        score_over =  request.args.get("score_over")
-        if not verify_type(type):
-            return {"error": "Invalid value for 'type' parameter"}, 400
-        if not verify_score(score_over):
-            return {"error": "Invalid value for 'score_over' parameter"}, 400
-        experiments = get_experiments(type, score_over, conn)
-        return experiments, 200    
+        return list_experiments(request.args)
     if request.method == "POST":
-        data = request.json
-        score = data.get("score", None)
-        experiment_type = data.get("experiment_type", None)
-        subject_id = data.get("subject_id", None)
-        experiment_date = data.get("experiment_date", None)
-        if not score:
-            return {"error": "Request missing key 'score'."}, 400
-        if not experiment_type:
-            return {"error": "Request missing key 'experiment_type'."}, 400
-        if not subject_id:
-            return {"error": "Request missing key 'subject_id'."}, 400
-        if not verify_subject_id(subject_id):
-            return {"error": "Invalid value for 'subject_id' parameter."}, 400
-        if not verify_type(experiment_type):
-            return {"error": "Invalid value for 'experiment_type' parameter."}, 400
-        if not verify_score(score):
-            return {"error": "Invalid value for 'score' parameter."}, 400
-        experiment = insert_experiment(subject_id, score, experiment_type, experiment_date, conn)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
+        db_conn = get_conn()
+        facility = g.get("facility", "")
+        client = client_id()
+        idempotency_key = request.headers.get("Idempotency-Key")
+        request_hash = None
+        if idempotency_key is not None:
+            if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+                return {"error": "Invalid value for 'Idempotency-Key' header."}, 400
+            request_hash = hash_request(data)
+            stored = (idempotency_cache.get((facility, client, idempotency_key))
+                      or get_idempotent_response(idempotency_key, IDEMPOTENCY_TTL, db_conn, client))
+            if stored:
+                return replay_experiment(client, idempotency_key, request_hash, stored)
+        error = validate_experiment(data, db_conn, facility)
+        if error:
+            return error, 400
+        try:
+            experiment = insert_experiment(int(data["subject_id"]), int(data["score"]),
+                                           data["experiment_type"], data.get("experiment_date"), db_conn,
+                                           idempotency_key, request_hash, IDEMPOTENCY_TTL, client)
+        except ScoreOutOfRange:
+            forget_experiment_types(facility)
+            return invalid("score"), 400
+        if experiment is None:
+            stored = get_idempotent_response(idempotency_key, IDEMPOTENCY_TTL, db_conn, client)
+            return replay_experiment(client, idempotency_key, request_hash, stored)
+        if idempotency_key is not None:
+            idempotency_cache.put((facility, client, idempotency_key), (request_hash, experiment))
         return experiment, 201
 
 
+def replay_experiment(client: str, idempotency_key: str, request_hash: str, stored: tuple) -> tuple:
+    """Returns the stored response for a retried POST, if the retry matches the original."""
+    stored_hash, experiment = stored
+    if stored_hash != request_hash:
+        return {"error": "Idempotency-Key was already used for a different request."}, 422
+    idempotency_cache.put((g.get("facility", ""), client, idempotency_key), stored)
+    return experiment, 201, {"Idempotent-Replayed": "true"}
+
+
+@app.get("/experiment/events")
+def experiment_events():
+    """Streams experiment inserts, updates and deletes as Server-Sent Events."""
+    return Response(stream_events(get_broadcaster()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/experiment/distribution")
+def experiment_distribution():
+    """Returns a histogram, percentiles and per-species z-scores of percentage scores."""
+    type = request.args.get("type")
+    species = request.args.get("species")
+    bins = as_int(request.args.get("bins", "10"))
+    if not verify_type(type):
+        return {"error": "Invalid value for 'type' parameter"}, 400
+    if species is not None and not 0 < len(species) <= 100:
+        return {"error": "Invalid value for 'species' parameter"}, 400
+    if bins is None or not 0 < bins <= MAX_HISTOGRAM_BINS:
+        return {"error": "Invalid value for 'bins' parameter"}, 400
+    data = copy_score_percentages(type, species, get_conn())
+    return score_distribution(data, get_species_names(get_conn()), bins), 200
+
+
+@app.get("/experiment/changes")
+def experiment_changes():
+    """Returns experiments inserted, updated or deleted since the caller's watermark."""
+    since = as_int(request.args.get("since", "0"))
+    if since is None:
+        return {"error": "Invalid value for 'since' parameter"}, 400
+    return get_experiment_changes(since, CHANGES_PAGE_SIZE, get_conn()), 200
+
+
 @app.route("/experiment/<id>", methods=["DELETE"])
 def delete_experiment(id):
     if not id.isnumeric():
         return {"error": "ID must be an integer"}, 400
-    experiment = delete_experiment_by_id(id, conn)
+    experiment = delete_experiment_by_id(id, get_conn())
     if not experiment:
         return {"error": f"Unable to locate experiment with ID {id}."}, 404
     return experiment, 200
 
 
+BATCH_ROUTES = {
+    "/subject": list_subjects,
+    "/subject/search": find_subjects,
+    "/experiment": list_experiments
+}
+
+
+@app.post("/batch")
+def batch():
+    """Runs several read requests on one read-only snapshot so their results agree.
+
+    Unfiltered experiment reads share a single scan when more than one is requested."""
+    data = request.get_json(silent=True)
+    sub_requests = data.get("requests") if isinstance(data, dict) else None
+    if (not isinstance(sub_requests, list) or not 0 < len(sub_requests) <= MAX_BATCH_REQUESTS
+            or not all(isinstance(sub, dict) and isinstance(sub.get("params", {}), dict)
+                       for sub in sub_requests)):
+        return {"error": "Invalid value for 'requests' parameter."}, 400
+
+    batch_conn = get_conn()
+    end_transaction(batch_conn)
+    with batch_conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+
+    experiment_reads = [sub for sub in sub_requests
+                        if sub.get("path") == "/experiment" and "fields" not in sub.get("params", {})]
+    experiment_rows = get_experiment_rows(None, get_conn()) if len(experiment_reads) > 1 else None
+
+    responses = []
+    for sub in sub_requests:
+        handler = BATCH_ROUTES.get(sub.get("path"))
+        if handler is None:
+            responses.append({"status": 404, "body": {"error": f"Unable to batch path {sub.get('path')}."}})
+            continue
+        params = {key: str(value) for key, value in sub.get("params", {}).items()}
+        if handler is list_experiments:
+            body, status = handler(params, experiment_rows)
+        else:
+            body, status = handler(params)
+        responses.append({"status": status, "body": body})
+    return {"responses": responses}, 200
+
+
+@app.post("/jobs")
+def create_job():
+    """Queues an export or aggregation to run outside the request."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    kind = data.get("kind")
+    params = data.get("params", {})
+    if kind not in JOB_KINDS:
+        return {"error": "Invalid value for 'kind' parameter."}, 400
+    if not isinstance(params, dict):
+        return {"error": "Invalid value for 'params' parameter."}, 400
+    params = {key: params.get(key) for key in ("type", "score_over")}
+    if params["type"] is not None and not (isinstance(params["type"], str) and verify_type(params["type"])):
+        return {"error": "Invalid value for 'type' parameter."}, 400
+    if params["score_over"] is not None and not verify_score(str(params["score_over"])):
+        return {"error": "Invalid value for 'score_over' parameter."}, 400
+    job = submit_job(kind, params, database_target())
+    return job, 202, {"Location": f"/jobs/{job['job_id']}"}
+
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    """Returns the status of a job."""
+    job = get_job(job_id)
+    if not job:
+        return {"error": f"Unable to locate job with ID {job_id}."}, 404
+    return job, 200
+
+
+@app.get("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Streams the result file of a finished job."""
+    job = get_job(job_id)
+    if not job:
+        return {"error": f"Unable to locate job with ID {job_id}."}, 404
+    if job["status"] != "done":
+        return {"error": f"Job {job_id} is {job['status']}."}, 409
+    return send_file(job_path(job_id, "json"), mimetype="application/json")
+
+
+@app.get("/admin/slow-queries")
+def slow_query_report():
+    """Returns recorded slow queries and their plans; requires the ADMIN_TOKEN header."""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token:
+        return {"error": "Admin endpoints are disabled."}, 404
+    if request.headers.get("X-Admin-Token") != admin_token:
+        return {"error": "Invalid admin token."}, 403
+    return slow_queries.report(), 200
+
+
+@app.get("/health/live")
+def liveness():
+    """Reports that the process is serving requests, without touching the database."""
+    return {"status": "ok"}, 200
+
+
+@app.get("/health/ready")
+def readiness():
+    """Reports whether the database can answer a query, so traffic is only sent once it can.
+
+    With a facility, that facility's database is checked instead of the default one.
+    The shared connection is only waited for briefly: if other requests keep it busy,
+    the worker is serving traffic and is reported ready rather than timing the probe out."""
+    if not g.get("facility"):
+        if not connection_lock.acquire(timeout=READINESS_LOCK_TIMEOUT):
+            return {"status": "ready", "database": "busy"}, 200
+        g.holds_connection = True
+    try:
+        ping(get_conn())
+    except (OperationalError, InterfaceError, CircuitOpenError, FacilityUnavailable) as error:
+        return {"status": "unavailable", "database": str(error).strip()}, 503
+    return {"status": "ready", "database": "ok"}, 200
+
+
+def warm_up() -> None:
+    """Opens the shared connection and fills the lookup caches.
+
+    Only bounded queries run here. Workers are recycled every max_requests, so
+    reading whole tables at boot would repeat a full scan in every worker.
+    If the database is down the worker starts anyway: the health endpoints report
+    it, and the connection and caches are filled on first use once it is back."""
+    try:
+        db_conn = get_shared_connection()
+        ping(db_conn)
+        warm_caches(db_conn)
+        end_transaction(db_conn)
+    except (OperationalError, InterfaceError, CircuitOpenError) as error:
+        logger.warning("Warm-up skipped, database unavailable: %s", str(error).strip())
+
+
 if __name__ == "__main__":
     app.config["DEBUG"] = True
     app.config["TESTING"] = True
 
     app.run(port=8000, debug=True)
 
-    conn.close()
+    if conn is not None:
+        conn.close()
@@ -0,0 +1,26 @@
+"""Moves experiments older than a cutoff out of the hot experiment table.
+
+Usage: python3 archive.py [months] [dbname]
+
+Run it regularly, e.g. nightly from cron. ARCHIVE_AFTER_MONTHS sets the default
+age (12 months). Archived experiments stay readable through
+GET /experiment?include_archived=true but are no longer changed or deleted.
+Expired idempotency keys are deleted at the same time.
+"""
+
+import os
+import sys
+
+from database_functions import get_db_connection, archive_experiments, purge_idempotency_keys
+from idempotency import IDEMPOTENCY_TTL
+
+
+if __name__ == "__main__":
+    months = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get("ARCHIVE_AFTER_MONTHS", 12))
+    db_conn = get_db_connection(sys.argv[2] if len(sys.argv) > 2 else "marine_experiments")
+    archived = archive_experiments(months, db_conn)
+    purged = purge_idempotency_keys(IDEMPOTENCY_TTL, db_conn)
+    db_conn.commit()
+    db_conn.close()
+    print(f"Archived {archived} experiments older than {months} months.")
+    print(f"Purged {purged} expired idempotency keys.")
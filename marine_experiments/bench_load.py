@@ -0,0 +1,250 @@
+"""Ramps up concurrent clients against a running API and reports where it saturates.
+
+Usage: python3 bench_load.py [--url URL] [--levels 1,2,4,...] [--duration SECONDS]
+                             [--mix subject=4,experiment=4,post=1,delete=1] [--db DBNAME]
+
+Each client is an asyncio task with its own HTTP connection and X-API-Key (the server
+only budgets per key for keys listed in its API_KEYS). At every concurrency level it
+reports throughput, latency percentiles, error and rate-limited rates, the connection
+wait the API reports in its Server-Timing header (time queued for the worker's
+connection or a facility pool, plus any reconnect), and the backends pg_stat_activity
+shows for the database. Deletes only remove experiments this run created, so the seed
+data survives.
+
+Start the server with rate limits raised, e.g.
+RATE_LIMIT_CAPACITY=1000000 RATE_LIMIT_REFILL=1000000 gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+from threading import Event
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from database_functions import get_db_connection
+
+
+EXPERIMENT_FILTERS = ("", "?type=intelligence", "?type=obedience&score_over=50",
+                      "?score_over=75", "?type=aggression")
+EXPERIMENT_TYPES = ("intelligence", "obedience", "aggression")
+CONNECTION_WAIT = re.compile(r"db-conn;dur=([\d.]+)")
+KNEE_FRACTION = 0.9
+SAMPLE_SECONDS = 0.25
+
+
+class Stats:
+    """Measurements for one concurrency level."""
+
+    def __init__(self):
+        self.latencies = []
+        self.connection_waits = []
+        self.errors = 0
+        self.rate_limited = 0
+        self.backends = []
+        self.waiting_backends = []
+
+    def record(self, seconds: float, status: int, headers: dict) -> None:
+        """Records one response; status 0 means the request failed outright."""
+        self.latencies.append(seconds)
+        if status == 429:
+            self.rate_limited += 1
+        elif not 200 <= status < 300 and status != 404:
+            self.errors += 1
+        match = CONNECTION_WAIT.search(headers.get("server-timing", ""))
+        if match:
+            self.connection_waits.append(float(match.group(1)))
+
+
+def percentile(values: list, rank: float) -> float:
+    """Returns the nearest-rank percentile of a list, or 0 if it is empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * rank / 100))]
+
+
+class Client:
+    """One virtual user holding a keep-alive HTTP/1.1 connection."""
+
+    def __init__(self, host: str, port: int, api_key: str):
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method: str, path: str, body: dict = None) -> tuple:
+        """Sends a request and returns (status, headers, body), reconnecting as needed."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nX-API-Key: {self.api_key}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n")
+        self.writer.write(head.encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Server closed the connection.")
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            data = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await self.reader.read()
+        if headers.get("connection", "").lower() == "close" or "content-length" not in headers:
+            await self.close()
+        return status, headers, data
+
+    async def close(self) -> None:
+        """Closes the connection; the next request opens a new one."""
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+def choose_request(mix: dict, subject_ids: list, created: list) -> tuple:
+    """Returns (method, path, body) for the next request in the mix."""
+    action = random.choices(list(mix), weights=list(mix.values()))[0]
+    if action == "delete" and created:
+        return "DELETE", f"/experiment/{created.pop()}", None
+    if action in ("post", "delete"):
+        return "POST", "/experiment", {
+            "subject_id": random.choice(subject_ids),
+            "experiment_type": random.choice(EXPERIMENT_TYPES),
+            "score": random.randint(0, 10),
+            "experiment_date": "2024-03-01"
+        }
+    if action == "subject":
+        return "GET", "/subject", None
+    return "GET", f"/experiment{random.choice(EXPERIMENT_FILTERS)}", None
+
+
+async def run_client(client: Client, mix: dict, subject_ids: list, created: list,
+                     stats: Stats, deadline: float) -> None:
+    """Sends requests back to back until the deadline."""
+    while perf_counter() < deadline:
+        method, path, body = choose_request(mix, subject_ids, created)
+        started = perf_counter()
+        try:
+            status, headers, data = await client.request(method, path, body)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            await client.close()
+            stats.record(perf_counter() - started, 0, {})
+            continue
+        stats.record(perf_counter() - started, status, headers)
+        if method == "POST" and status == 201:
+            created.append(json.loads(data)["experiment_id"])
+
+
+def sample_backends(dbname: str, stats: Stats, stop) -> None:
+    """Samples pg_stat_activity for the database until stop is set."""
+    conn = get_db_connection(dbname)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            while not stop.wait(SAMPLE_SECONDS):
+                cur.execute("""SELECT COUNT(*) AS backends,
+                                      COUNT(*) FILTER (WHERE state = 'active'
+                                          AND wait_event_type IN ('Lock', 'LWLock', 'IO')) AS waiting
+                               FROM pg_stat_activity
+                               WHERE datname = %s AND pid <> pg_backend_pid();""", [dbname])
+                row = cur.fetchone()
+                stats.backends.append(row["backends"])
+                stats.waiting_backends.append(row["waiting"])
+    finally:
+        conn.close()
+
+
+async def run_level(host: str, port: int, concurrency: int, duration: float, mix: dict,
+                    subject_ids: list, created: list, dbname: str | None) -> tuple:
+    """Runs one concurrency level and returns (stats, elapsed seconds)."""
+    stats = Stats()
+    stop = Event()
+    sampler = asyncio.create_task(asyncio.to_thread(sample_backends, dbname, stats, stop)) if dbname else None
+    clients = [Client(host, port, f"load-{concurrency}-{i}") for i in range(concurrency)]
+    started = perf_counter()
+    await asyncio.gather(*(run_client(client, mix, subject_ids, created, stats, started + duration)
+                           for client in clients))
+    elapsed = perf_counter() - started
+    for client in clients:
+        await client.close()
+    if sampler:
+        stop.set()
+        await sampler
+    return stats, elapsed
+
+
+def find_knee(results: list) -> int | None:
+    """Returns the lowest concurrency that reaches 90% of the peak throughput."""
+    if not results:
+        return None
+    peak = max(throughput for _, throughput, _ in results)
+    return next(concurrency for concurrency, throughput, _ in results
+                if throughput >= KNEE_FRACTION * peak)
+
+
+def print_level(concurrency: int, stats: Stats, elapsed: float) -> float:
+    """Prints one row of the report and returns the level's throughput."""
+    count = len(stats.latencies)
+    throughput = count / elapsed
+    ms = [latency * 1000 for latency in stats.latencies]
+    print(f"{concurrency:>5} {throughput:>9.1f} {percentile(ms, 50):>8.1f} {percentile(ms, 95):>8.1f} "
+          f"{percentile(ms, 99):>8.1f} {100 * stats.errors / max(count, 1):>6.2f}% "
+          f"{100 * stats.rate_limited / max(count, 1):>6.2f}% "
+          f"{percentile(stats.connection_waits, 99):>10.3f} "
+          f"{max(stats.backends, default=0):>8} {max(stats.waiting_backends, default=0):>7}")
+    return throughput
+
+
+async def main(args) -> None:
+    """Runs every level in turn and prints the saturation report."""
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    mix = {name: float(weight) for name, weight in
+           (entry.split("=") for entry in args.mix.split(","))}
+
+    status, _, data = await Client(host, port, "load-setup").request("GET", "/subject")
+    if status != 200:
+        raise SystemExit(f"GET /subject returned {status}; is the server running?")
+    subject_ids = [subject["subject_id"] for subject in json.loads(data)]
+
+    print(f"{'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'429s':>7} {'p99 conn ms':>10} {'backends':>8} {'waiting':>7}")
+    results = []
+    created = []
+    for concurrency in (int(level) for level in args.levels.split(",")):
+        stats, elapsed = await run_level(host, port, concurrency, args.duration, mix,
+                                         subject_ids, created, args.db)
+        throughput = print_level(concurrency, stats, elapsed)
+        results.append((concurrency, throughput, percentile(stats.latencies, 99)))
+
+    cleanup = Client(host, port, "load-cleanup")
+    for experiment_id in created:
+        await cleanup.request("DELETE", f"/experiment/{experiment_id}")
+    await cleanup.close()
+
+    knee = find_knee(results)
+    print(f"\nThroughput knee: {knee} concurrent clients "
+          f"({KNEE_FRACTION:.0%} of the peak of {max(t for _, t, _ in results):.1f} req/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--mix", default="subject=4,experiment=4,post=1,delete=1")
+    parser.add_argument("--db", default="marine_experiments",
+                        help="database to sample pg_stat_activity for; empty to skip")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""Compares the memory cost of dict rows and tuple rows on a large result.
+
+Usage: python3 bench_row_memory.py [rows] [dbname]
+"""
+
+import sys
+import tracemalloc
+from time import perf_counter
+
+from psycopg2.extensions import cursor
+from psycopg2.extras import RealDictCursor
+
+from database_functions import get_db_connection, format_experiments
+
+
+SYNTHETIC_EXPERIMENTS = """
+    SELECT n AS experiment_id, n %% 1000 AS subject_id, 'Orca' AS species_name,
+           DATE '2024-01-01' + (n %% 365) AS experiment_date, 'intelligence' AS type_name,
+           (n %% 31)::DECIMAL / 30 * 100 AS score_percentage
+    FROM generate_series(1, %s) AS n;
+"""
+
+
+def measure(conn, rows: int, cursor_factory, convert) -> tuple[float, float, float]:
+    """Returns (fetched bytes per row, peak bytes per row, seconds) for one row type."""
+    tracemalloc.start()
+    start = perf_counter()
+    cur = conn.cursor(cursor_factory=cursor_factory)
+    cur.execute(SYNTHETIC_EXPERIMENTS, [rows])
+    fetched = cur.fetchall()
+    fetched_bytes = tracemalloc.get_traced_memory()[0]
+    formatted = convert(fetched)
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    cur.close()
+    del fetched, formatted
+    return fetched_bytes / rows, peak / rows, elapsed
+
+
+def dict_rows_to_output(rows: list[dict]) -> list[dict]:
+    """The previous read path: a dict per fetched row, copied into a second dict."""
+    return [{
+        "experiment_id": row["experiment_id"],
+        "subject_id": row["subject_id"],
+        "species": row["species_name"],
+        "experiment_date": row["experiment_date"].strftime("%Y-%m-%d"),
+        "experiment_type": row["type_name"],
+        "score": f'{row["score_percentage"] / 100:.2%}'
+        } for row in rows]
+
+
+if __name__ == "__main__":
+    total_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    db_conn = get_db_connection(sys.argv[2] if len(sys.argv) > 2 else "marine_experiments")
+
+    results = {
+        "RealDictCursor": measure(db_conn, total_rows, RealDictCursor, dict_rows_to_output),
+        "tuple cursor": measure(db_conn, total_rows, cursor,
+                                format_experiments)
+    }
+    db_conn.rollback()
+    db_conn.close()
+
+    print(f"{total_rows:,} rows")
+    for name, (fetched, peak, seconds) in results.items():
+        print(f"{name:>15}: {fetched:7.0f} B/row fetched, {peak:7.0f} B/row peak, {seconds:6.2f}s")
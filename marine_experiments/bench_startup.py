@@ -0,0 +1,50 @@
+"""Measures how long the API takes to import, to start, and to answer its first request.
+
+Usage: python3 bench_startup.py [runs]
+
+Every measurement runs in a fresh interpreter, so nothing is cached between runs.
+The import is also timed with the database unreachable, which should make no difference.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+
+MEASURE = """
+from time import perf_counter
+started = perf_counter()
+import api
+imported = perf_counter()
+from wsgi import create_app
+{step}
+print(imported - started, perf_counter() - imported)
+"""
+STEPS = {
+    "import only": "",
+    "create_app()": "create_app()",
+    "first request": "create_app(warm=False).test_client().get('/subject')"
+}
+
+
+def measure(step: str, env: dict) -> tuple[float, float]:
+    """Returns (import seconds, seconds for the step) from a fresh interpreter."""
+    output = subprocess.run([sys.executable, "-c", MEASURE.format(step=step)], env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    imported, stepped = output.split()
+    return float(imported), float(stepped)
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    unreachable = {**os.environ, "DB_PORT": "1"}
+
+    print(f"median of {runs} runs")
+    for name, step in STEPS.items():
+        results = [measure(step, os.environ) for _ in range(runs)]
+        print(f"{name:>22}: import {statistics.median(r[0] for r in results) * 1000:7.1f} ms, "
+              f"then {statistics.median(r[1] for r in results) * 1000:7.1f} ms")
+    results = [measure("", unreachable) for _ in range(runs)]
+    print(f"{'import, database down':>22}: import {statistics.median(r[0] for r in results) * 1000:7.1f} ms")
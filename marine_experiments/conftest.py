@@ -4,14 +4,70 @@
 
 import pytest
 
-from api import app
-from database_functions import get_db_connection
+from api import app, limiter, broadcaster, idempotency_cache
+from database_functions import get_db_connection, db_breaker
+from facilities import FacilityPools
+from validation import clear_caches
 
 
 @pytest.fixture
 def test_api():
     return app.test_client()
 
+
+@pytest.fixture(autouse=True)
+def clear_validation_caches():
+    """Stops cached lookups leaking between test databases."""
+    clear_caches()
+    idempotency_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Gives every test a full request budget."""
+    limiter.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breaker():
+    """Stops failures recorded by one test from opening the circuit in the next."""
+    db_breaker.reset()
+
+
+@pytest.fixture
+def event_broadcaster():
+    """Yields the API's event broadcaster and stops its listener afterwards."""
+    yield broadcaster
+    broadcaster.stop()
+
+
+@pytest.fixture
+def north_facility(monkeypatch):
+    """Routes the 'north' facility to a second test database with no experiments."""
+    conn = get_db_connection("postgres")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP DATABASE IF EXISTS test_marine_north;")
+        cur.execute("CREATE DATABASE test_marine_north;")
+    conn.close()
+    conn = get_db_connection("test_marine_north")
+    with conn.cursor() as cur:
+        with open("setup-db.sql", "r") as f:
+            for q in f.read().split("\n\n"):
+                cur.execute(q)
+        cur.execute("DELETE FROM experiment;")
+    conn.commit()
+    conn.close()
+    pools = FacilityPools({"north": "test_marine_north"}, get_db_connection)
+    monkeypatch.setattr("api.facility_pools", pools)
+    yield pools
+    pools.close_all()
+    conn = get_db_connection("postgres")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP DATABASE test_marine_north WITH (FORCE);")
+    conn.close()
+
 # The fixtures below this comment are used by the existing tests; to avoid unexpected complications, your own tests should NOT
 # interact with them.
 
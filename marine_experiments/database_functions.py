@@ -1,56 +1,155 @@
 """Functions that interact with the database."""
 
 from psycopg2 import connect
-from psycopg2.extras import RealDictCursor
-from psycopg2.extensions import connection
+from psycopg2.extras import RealDictCursor, Json
+from psycopg2.extensions import connection, cursor, parse_dsn
+import os
 from datetime import datetime
+from io import BytesIO
 
+from resilience import CircuitBreaker
+from slow_queries import timed_execute
 
-def format_subjects(subjects: list[dict]) -> list[dict]:
-    subjects_formatted = []
-    for subject in subjects:
-        date_str = subject["date_of_birth"].strftime("%Y-%m-%d")
-        subjects_formatted.append({
-            "subject_id": subject["subject_id"],
-            "subject_name": subject["subject_name"],
-            "species_name": subject["species_name"],
-            "date_of_birth": date_str
-        })
-    return subjects_formatted
-
-
-def format_experiments(experiments: list[dict], score_over:str ) -> list[dict]:
-    experiments_formatted = []
-    for experiment in experiments:
-        score_percentage = float((experiment["score"] / experiment["max_score"]) * 100)
-        if score_percentage > int(score_over):
-            date_str = experiment["experiment_date"].strftime("%Y-%m-%d")
-            experiments_formatted.append({
-                "experiment_id": experiment["experiment_id"],
-                "subject_id": experiment["subject_id"],
-                "species": experiment["species_name"],
-                "experiment_date": date_str,
-                "experiment_type": experiment["type_name"],
-                "score": f'{(score_percentage/100):.2%}'
-                    })
-    return experiments_formatted
+
+db_breaker = CircuitBreaker()
+CHANGE_TOKEN_BITS = 64
+CHANGE_ID_MASK = (1 << CHANGE_TOKEN_BITS) - 1
+IDEMPOTENCY_PURGE_BATCH = 100
+
+
+class ScoreOutOfRange(Exception):
+    """Raised when a score exceeds its experiment type's current max_score."""
+
+SUBJECT_COLUMNS = {
+    "subject_id": "subject.subject_id",
+    "subject_name": "subject.subject_name",
+    "species_name": "species.species_name",
+    "date_of_birth": "subject.date_of_birth"
+}
+EXPERIMENT_COLUMNS = {
+    "experiment_id": "experiment.experiment_id",
+    "subject_id": "experiment.subject_id",
+    "species": "species.species_name",
+    "experiment_date": "experiment.experiment_date",
+    "experiment_type": "experiment_type.type_name",
+    "score": "experiment.score_percentage"
+}
+
+ALL_EXPERIMENTS = """(
+                SELECT experiment_id, subject_id, experiment_type_id, experiment_date, score_percentage
+                FROM experiment
+                UNION ALL
+                SELECT experiment_id, subject_id, experiment_type_id, experiment_date, score_percentage
+                FROM experiment_archive
+                WHERE deleted_at IS NULL
+            ) AS experiment"""
+EXPERIMENTS_QUERY_TEMPLATE = """
+            SELECT experiment.experiment_id, experiment.subject_id, species.species_name, experiment.experiment_date, experiment_type.type_name, experiment.score_percentage
+            FROM {source}
+            JOIN subject USING (subject_id)
+            JOIN species USING (species_id)
+            JOIN experiment_type USING(experiment_type_id)
+            WHERE experiment_type.type_name LIKE %s
+            AND experiment.score_percentage > %s
+            ORDER BY experiment.experiment_date DESC
+            ;
+         """
+EXPERIMENTS_QUERY = EXPERIMENTS_QUERY_TEMPLATE.format(source="experiment")
+ALL_EXPERIMENTS_QUERY = EXPERIMENTS_QUERY_TEMPLATE.format(source=ALL_EXPERIMENTS)
+
+
+def format_subjects(subjects: list[tuple]) -> list[dict]:
+    return [{
+        "subject_id": subject_id,
+        "subject_name": subject_name,
+        "species_name": species_name,
+        "date_of_birth": date_of_birth.strftime("%Y-%m-%d")
+        } for subject_id, subject_name, species_name, date_of_birth in subjects]
+
+
+def format_experiments(experiments: list[tuple]) -> list[dict]:
+    """Returns experiment rows as dicts, formatting the stored percentage as it is.
+
+    Rows are not filtered here; score_over is applied by the query that read them."""
+    return [{
+        "experiment_id": experiment_id,
+        "subject_id": subject_id,
+        "species": species_name,
+        "experiment_date": experiment_date.strftime("%Y-%m-%d"),
+        "experiment_type": type_name,
+        "score": f"{score_percentage:.2f}%"
+        } for experiment_id, subject_id, species_name, experiment_date, type_name, score_percentage
+        in experiments]
+
+
+FIELD_FORMATTERS = {
+    "date_of_birth": lambda value: value.strftime("%Y-%m-%d"),
+    "experiment_date": lambda value: value.strftime("%Y-%m-%d"),
+    "score": lambda value: f"{value:.2f}%"
+}
+
+
+def format_fields(rows: list[tuple], fields: list[str]) -> list[dict]:
+    """Returns projected rows as dicts, formatting dates and percentage scores."""
+    formatters = [FIELD_FORMATTERS.get(field) for field in fields]
+    return [{
+        field: formatter(value) if formatter else value
+        for field, formatter, value in zip(fields, formatters, row)
+        } for row in rows]
+
+
+def parse_fields(fields: str | None, columns: dict) -> list[str] | None:
+    """Returns the requested fields in canonical order, or None if any are unknown."""
+    requested = {field.strip() for field in fields.split(",")} - {""}
+    if not requested or not requested <= columns.keys():
+        return None
+    return [field for field in columns if field in requested]
+
+
+def connection_settings(database: str, password: str = None) -> dict:
+    """Returns connect() arguments for a database name or a connection string.
+
+    A bare name uses DB_HOST, DB_PORT, DB_USER and DB_PASSWORD. A postgresql:// URI
+    or key=value DSN may set any of these itself, e.g. for a facility on another server."""
+    settings = {"host": os.environ.get("DB_HOST", "localhost"),
+                "port": int(os.environ.get("DB_PORT", 5432)),
+                "password": password or os.environ.get("DB_PASSWORD", "postgres"),
+                "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", 5))}
+    if os.environ.get("DB_USER"):
+        settings["user"] = os.environ["DB_USER"]
+    if "=" in database or "://" in database:
+        settings.update(parse_dsn(database))
+    else:
+        settings["dbname"] = database
+    return settings
 
 
 def get_db_connection(dbname,
-                      password="postgres") -> connection:
-    """Returns a DB connection."""
+                      password=None) -> connection:
+    """Returns a DB connection to a database name or connection string."""
+
+    return connect(**connection_settings(dbname, password), cursor_factory=RealDictCursor)
+
+
+def tuple_cursor(conn: connection) -> cursor:
+    """Returns a cursor yielding plain tuples, whatever the connection's default."""
+    return conn.cursor(cursor_factory=cursor)
+
 
-    return connect(dbname=dbname,
-                   host="localhost",
-                   port=5432,
-                   password=password,
-                   cursor_factory=RealDictCursor)
+def ping(conn: connection) -> None:
+    """Runs a trivial query, raising if the database cannot answer it.
 
+    Deliberately not behind the circuit breaker, so readiness checks see recovery at once."""
+    with tuple_cursor(conn) as cur:
+        cur.execute("SELECT 1;")
 
+
+@db_breaker
 def get_subjects(conn) -> list[dict]:
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT * FROM subject
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
+        SELECT subject.subject_id, subject.subject_name, species.species_name, subject.date_of_birth
+        FROM subject
         JOIN species USING (species_id)
         ORDER BY subject.date_of_birth DESC;
          """)
@@ -59,83 +158,433 @@ def get_subjects(conn) -> list[dict]:
     return format_subjects(subjects)
 
 
-def get_experiments(type: str, score_over: int, conn) -> list[dict]:
-    if not score_over:
-        score_over = 0
+@db_breaker
+def get_subject_fields(fields: list[str], conn) -> list[dict]:
+    """Returns subjects with only the given fields, selecting only the columns they need.
+
+    Fields must come from parse_fields, which limits them to SUBJECT_COLUMNS."""
+    species_join = "JOIN species USING (species_id)" if "species_name" in fields else ""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, f"""
+        SELECT {", ".join(SUBJECT_COLUMNS[field] for field in fields)}
+        FROM subject
+        {species_join}
+        ORDER BY subject.date_of_birth DESC;
+         """)
+    subjects = cur.fetchall()
+    cur.close()
+    return format_fields(subjects, fields)
+
+
+@db_breaker
+def search_subjects(query: str, limit: int, conn) -> list[dict]:
+    """Returns subjects whose name or species starts with or resembles the query.
+
+    Name prefix matches rank first, then species prefix matches, then trigram
+    similarity, with species similarity weighted slightly below name similarity."""
+    prefix = query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
+        WITH matches AS (
+            (SELECT subject_id, 2 AS tier, similarity(subject_name, %(query)s) AS rank
+             FROM subject
+             WHERE lower(subject_name) LIKE %(prefix)s
+             ORDER BY lower(subject_name)
+             LIMIT %(limit)s)
+            UNION ALL
+            (SELECT subject_id, 0 AS tier, similarity(subject_name, %(query)s) AS rank
+             FROM subject
+             WHERE subject_name %% %(query)s
+             ORDER BY rank DESC
+             LIMIT %(limit)s)
+            UNION ALL
+            (SELECT species_subject.subject_id, matched_species.tier, matched_species.rank
+             FROM (SELECT species_id, CASE WHEN lower(species_name) LIKE %(prefix)s THEN 1 ELSE 0 END AS tier,
+                          similarity(species_name, %(query)s) * 0.9 AS rank
+                   FROM species
+                   WHERE lower(species_name) LIKE %(prefix)s OR species_name %% %(query)s) AS matched_species
+             CROSS JOIN LATERAL (SELECT subject_id
+                                 FROM subject
+                                 WHERE subject.species_id = matched_species.species_id
+                                 ORDER BY subject.subject_name
+                                 LIMIT %(limit)s) AS species_subject)
+        ),
+        best AS (
+            SELECT subject_id, MAX(tier) AS tier, MAX(rank) AS rank
+            FROM matches
+            GROUP BY subject_id
+        )
+        SELECT subject.subject_id, subject.subject_name, species.species_name, subject.date_of_birth
+        FROM best
+        JOIN subject USING (subject_id)
+        JOIN species USING (species_id)
+        ORDER BY best.tier DESC, best.rank DESC, subject.subject_name
+        LIMIT %(limit)s
+        ;""", {"query": query, "prefix": prefix, "limit": limit})
+    subjects = cur.fetchall()
+    cur.close()
+    return format_subjects(subjects)
+
+
+@db_breaker
+def get_subject_ids(conn) -> set[int]:
+    """Returns the ids of every subject."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, "SELECT subject_id FROM subject;")
+    subject_ids = {subject_id for (subject_id,) in cur.fetchall()}
+    cur.close()
+    return subject_ids
+
+
+@db_breaker
+def get_experiment_types(conn) -> dict:
+    """Returns experiment types keyed by name."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, "SELECT experiment_type_id, type_name, max_score FROM experiment_type;")
+    experiment_types = {type_name: {
+        "experiment_type_id": experiment_type_id,
+        "max_score": max_score
+        } for experiment_type_id, type_name, max_score in cur.fetchall()}
+    cur.close()
+    return experiment_types
+
+
+def get_experiments(type: str, score_over: int, conn, include_archived: bool = False) -> list[dict]:
+    return format_experiments(get_experiment_rows(type, conn, include_archived, int(score_over or 0)))
+
+
+@db_breaker
+def get_experiment_rows(type: str, conn, include_archived: bool = False,
+                        score_over: int = -1) -> list[tuple]:
+    """Returns unformatted experiment rows, newest first, for callers that filter them further.
+
+    Rows are filtered on the stored score_percentage; the default of -1 keeps every row."""
     if not type:
         type = ''
     else:
         type = type.lower()
-    cur = conn.cursor()
-    cur.execute(f"""
-            SELECT experiment.experiment_id, experiment.subject_id, species.species_name, experiment.experiment_date, experiment_type.type_name, experiment.score, experiment_type.max_score
-            FROM experiment
-            JOIN subject USING (subject_id)
-            JOIN species USING (species_id)
-            JOIN experiment_type USING(experiment_type_id)
-            WHERE experiment_type.type_name LIKE '%{type}%'
+    cur = tuple_cursor(conn)
+    timed_execute(cur, ALL_EXPERIMENTS_QUERY if include_archived else EXPERIMENTS_QUERY,
+                  [f"%{type}%", score_over])
+    experiments = cur.fetchall()
+    cur.close()
+    return experiments
+
+
+@db_breaker
+def get_experiment_fields(type: str, score_over: int, fields: list[str], conn,
+                          include_archived: bool = False) -> list[dict]:
+    """Returns experiments with only the given fields, selecting only the columns they need.
+
+    Fields must come from parse_fields, which limits them to EXPERIMENT_COLUMNS."""
+    species_join = ("JOIN subject USING (subject_id) JOIN species USING (species_id)"
+                    if "species" in fields else "")
+    cur = tuple_cursor(conn)
+    timed_execute(cur, f"""
+            SELECT {", ".join(EXPERIMENT_COLUMNS[field] for field in fields)}
+            FROM {ALL_EXPERIMENTS if include_archived else "experiment"}
+            JOIN experiment_type USING (experiment_type_id)
+            {species_join}
+            WHERE experiment_type.type_name LIKE %s
+            AND experiment.score_percentage > %s
             ORDER BY experiment.experiment_date DESC
             ;
-         """)
+         """, [f"%{(type or '').lower()}%", int(score_over or 0)])
     experiments = cur.fetchall()
     cur.close()
-    return format_experiments(experiments, score_over)
+    return format_fields(experiments, fields)
+
+
+def iter_experiments(type: str, score_over: int, conn, batch_size: int = 10000):
+    """Yields formatted experiments in batches from a server-side cursor.
+
+    Unlike get_experiments, memory use stays flat however many rows match."""
+    cur = conn.cursor(name="iter_experiments", cursor_factory=cursor)
+    cur.itersize = batch_size
+    cur.execute(EXPERIMENTS_QUERY, [f"%{(type or '').lower()}%", int(score_over or 0)])
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield format_experiments(rows)
+    cur.close()
+
+
+@db_breaker
+def get_score_aggregates(type: str | None, score_over: int | None, conn) -> list[dict]:
+    """Returns the count and mean percentage score for each species and experiment type.
+
+    Only experiments matching the type and scoring over score_over are counted,
+    as for GET /experiment; without score_over every experiment counts."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
+        SELECT species.species_name, experiment_type.type_name, COUNT(*),
+               ROUND(AVG(experiment.score_percentage), 2)
+        FROM experiment
+        JOIN subject USING (subject_id)
+        JOIN species USING (species_id)
+        JOIN experiment_type USING (experiment_type_id)
+        WHERE experiment_type.type_name LIKE %s
+        AND experiment.score_percentage > %s
+        GROUP BY species.species_name, experiment_type.type_name
+        ORDER BY species.species_name, experiment_type.type_name
+        ;""", [f"%{(type or '').lower()}%", -1 if score_over is None else int(score_over)])
+    aggregates = [{
+        "species": species_name,
+        "experiment_type": type_name,
+        "experiments": count,
+        "mean_score": f"{mean_score:.2f}%"
+        } for species_name, type_name, count, mean_score in cur.fetchall()]
+    cur.close()
+    return aggregates
 
 
+@db_breaker
+def archive_experiments(older_than_months: int, conn, batch_size: int = 10000) -> int:
+    """Moves experiments older than the cutoff into experiment_archive and returns how many moved.
+
+    Each batch commits on its own, so locks stay short. The experiment_archive_copy
+    trigger does the copying; marine.archiving tells the triggers this is not a delete."""
+    cur = tuple_cursor(conn)
+    archived = 0
+    while True:
+        timed_execute(cur, "SET LOCAL marine.archiving = 'on';")
+        timed_execute(cur, """
+            DELETE FROM experiment
+            WHERE experiment_id IN (
+                SELECT experiment_id
+                FROM experiment
+                WHERE experiment_date < CURRENT_DATE - make_interval(months => %s)
+                ORDER BY experiment_date, experiment_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED)
+            ;""", [older_than_months, batch_size])
+        moved = cur.rowcount
+        conn.commit()
+        archived += moved
+        if moved < batch_size:
+            break
+    cur.close()
+    return archived
+
+
+@db_breaker
 def delete_experiment_by_id(id: int, conn) -> dict | None:
-    cur = conn.cursor()
-    cur.execute("""
+    """Deletes an experiment and returns its id and date, or None if there is none.
+
+    An archived experiment is marked with deleted_at instead, which a trigger
+    records as a delete in the change feed."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
         DELETE FROM experiment
         WHERE experiment_id = %s
         RETURNING experiment_id, experiment_date
         ;""",
         [id])
-    experiment = cur.fetchall()
-    if experiment:
-        experiment = experiment[0]
-        correct_date = experiment["experiment_date"].strftime("%Y-%m-%d")
-        formatted_experiment = {
-        "experiment_id": experiment["experiment_id"],
-        "experiment_date": correct_date
-        }
-        cur.close()
-        conn.commit()
-        return formatted_experiment
+    experiment = cur.fetchone()
+    if not experiment:
+        timed_execute(cur, """
+            UPDATE experiment_archive
+            SET deleted_at = CURRENT_TIMESTAMP
+            WHERE experiment_id = %s
+            AND deleted_at IS NULL
+            RETURNING experiment_id, experiment_date
+            ;""",
+            [id])
+        experiment = cur.fetchone()
     cur.close()
     conn.commit()
-    return experiment
+    if not experiment:
+        return None
+    experiment_id, experiment_date = experiment
+    return {
+        "experiment_id": experiment_id,
+        "experiment_date": experiment_date.strftime("%Y-%m-%d")
+        }
+
 
+@db_breaker
+def insert_experiment(subject_id, score, experiment_type, experiment_date, conn,
+                      idempotency_key: str = None, request_hash: str = None,
+                      idempotency_ttl: int = 86400, client: str = "") -> dict | None:
+    """Inserts an experiment and returns it as the API reports it.
 
-def insert_experiment(subject_id, score, experiment_type, experiment_date, conn) -> dict:
+    With an idempotency key, the response is stored under the client's key in the
+    same transaction, and a few expired keys are purged. If a live response is
+    already stored under that key, nothing is inserted and None is returned.
+
+    The type's max_score is read and locked here, so a score validated against a
+    cached max_score that has since been lowered raises ScoreOutOfRange."""
     if not experiment_date:
         experiment_date = datetime.now().strftime("%Y-%m-%d")
-    cur = conn.cursor()
-    cur.execute( """
-        SELECT experiment_type_id
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
+        SELECT experiment_type_id, max_score
         FROM experiment_type
         WHERE type_name = %s
+        FOR SHARE
                  """, [experiment_type.lower()])
-    experiment_type__id = cur.fetchone().get("experiment_type_id")
-    cur.execute("""
+    experiment_type__id, max_score = cur.fetchone()
+    if score > max_score:
+        cur.close()
+        conn.rollback()
+        raise ScoreOutOfRange(experiment_type)
+    timed_execute(cur, """
         INSERT INTO experiment (subject_id, experiment_type_id, experiment_date, score )
         VALUES (%s, %s, %s, %s)
-        RETURNING *
+        RETURNING experiment_id, subject_id, experiment_type_id, experiment_date, score
         ;
         """,
         [subject_id, experiment_type__id, experiment_date, score])
-    experiment = cur.fetchall()
-    if experiment:
-        experiment = experiment[0]
-        correct_date = experiment["experiment_date"].strftime("%Y-%m-%d")
-        formatted_experiment = {
-            "experiment_id": experiment["experiment_id"],
-            "subject_id": experiment["subject_id"],
-            "experiment_type_id": experiment["experiment_type_id"],
-            "experiment_date": correct_date,
-            "score": experiment["score"]
-            }
-        cur.close()
-        conn.commit()
-        return formatted_experiment
+    experiment_id, subject_id, experiment_type_id, experiment_date, score = cur.fetchone()
+    formatted_experiment = {
+        "experiment_id": experiment_id,
+        "subject_id": subject_id,
+        "experiment_type_id": experiment_type_id,
+        "experiment_date": experiment_date.strftime("%Y-%m-%d"),
+        "score": int(score)
+        }
+    if idempotency_key is not None:
+        timed_execute(cur, """
+            INSERT INTO idempotency_key (client, idempotency_key, request_hash, response)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (client, idempotency_key) DO UPDATE
+            SET request_hash = EXCLUDED.request_hash, response = EXCLUDED.response,
+                created_at = CURRENT_TIMESTAMP
+            WHERE idempotency_key.created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            RETURNING idempotency_key
+            ;""", [client, idempotency_key, request_hash, Json(formatted_experiment), idempotency_ttl])
+        if cur.fetchone() is None:
+            cur.close()
+            conn.rollback()
+            return None
+        purge_idempotency_keys(idempotency_ttl, conn, IDEMPOTENCY_PURGE_BATCH)
+    cur.close()
+    conn.commit()
+    return formatted_experiment
+
+
+@db_breaker
+def get_idempotent_response(idempotency_key: str, idempotency_ttl: int, conn,
+                            client: str = "") -> tuple | None:
+    """Returns the (request hash, response) stored under a client's live idempotency key, or None."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
+        SELECT request_hash, response
+        FROM idempotency_key
+        WHERE client = %s
+        AND idempotency_key = %s
+        AND created_at >= CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        ;""", [client, idempotency_key, idempotency_ttl])
+    stored = cur.fetchone()
+    cur.close()
+    return stored
+
+
+def purge_idempotency_keys(idempotency_ttl: int, conn, limit: int | None = None) -> int:
+    """Deletes up to limit expired idempotency keys, or all of them, and returns how many went.
+
+    Keys another transaction is already deleting are skipped, so concurrent
+    purges never wait on each other. The caller commits."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, """
+        DELETE FROM idempotency_key
+        WHERE (client, idempotency_key) IN (
+            SELECT client, idempotency_key
+            FROM idempotency_key
+            WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        );""", [idempotency_ttl, limit])
+    purged = cur.rowcount
+    cur.close()
+    return purged
+
+
+def change_token(xid: int, change_id: int) -> int:
+    """Returns the watermark for a change: its transaction id, then its change id."""
+    return xid << CHANGE_TOKEN_BITS | change_id
+
+
+@db_breaker
+def get_experiment_changes(since: int, limit: int, conn) -> dict:
+    """Returns the net change to each experiment after the `since` watermark.
+
+    Only the latest change per experiment is returned: an upsert carrying the
+    current row, or a delete tombstone. Archived experiments still count as current. `next` is the watermark for the following call.
+
+    Changes are ordered by the id of the transaction that made them, and only
+    changes from transactions older than every running one are returned. A
+    transaction that commits late therefore cannot land behind a watermark the
+    caller has already passed; a long-running transaction holds the feed back instead."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, f"""
+        WITH latest AS (
+            SELECT DISTINCT ON (experiment_id) xid, change_id, experiment_id, operation
+            FROM experiment_change
+            WHERE (xid, change_id) > (%s::text::xid8, %s)
+            AND xid < pg_snapshot_xmin(pg_current_snapshot())
+            ORDER BY experiment_id, xid DESC, change_id DESC
+        )
+        SELECT latest.xid::text, latest.change_id, latest.operation, latest.experiment_id, experiment.subject_id, species.species_name, experiment.experiment_date, experiment_type.type_name, experiment.score_percentage
+        FROM latest
+        LEFT JOIN {ALL_EXPERIMENTS} USING (experiment_id)
+        LEFT JOIN subject USING (subject_id)
+        LEFT JOIN species USING (species_id)
+        LEFT JOIN experiment_type USING (experiment_type_id)
+        ORDER BY latest.xid, latest.change_id
+        LIMIT %s
+        ;""", [since >> CHANGE_TOKEN_BITS, since & CHANGE_ID_MASK, limit])
+    rows = cur.fetchall()
+    cur.close()
+    upserts = iter(format_experiments([row[3:] for row in rows if row[4] is not None]))
+    changes = []
+    for _, change_id, operation, experiment_id, subject_id, *_ in rows:
+        if subject_id is None:
+            changes.append({"change_id": change_id, "operation": "delete",
+                            "experiment_id": experiment_id})
+        else:
+            changes.append({"change_id": change_id, "operation": "upsert",
+                            "experiment": next(upserts)})
+    return {
+        "changes": changes,
+        "next": str(change_token(int(rows[-1][0]), rows[-1][1]) if rows else since),
+        "has_more": len(rows) == limit
+        }
+
+
+@db_breaker
+def copy_score_percentages(type: str | None, species: str | None, conn) -> memoryview:
+    """Returns (species_id, percentage score) pairs as a binary COPY stream.
+
+    Binary COPY sends each row as fixed-width bytes, so callers can decode
+    millions of rows without building a Python object per row. The stream is
+    returned as a view of the receive buffer rather than a copy of it."""
+    cur = tuple_cursor(conn)
+    query = cur.mogrify("""
+        COPY (
+            SELECT subject.species_id, experiment.score_percentage::FLOAT8
+            FROM experiment
+            JOIN experiment_type USING (experiment_type_id)
+            JOIN subject USING (subject_id)
+            JOIN species USING (species_id)
+            WHERE experiment.score_percentage IS NOT NULL
+            AND (%(type)s IS NULL OR experiment_type.type_name = %(type)s)
+            AND (%(species)s IS NULL OR lower(species.species_name) = %(species)s)
+        ) TO STDOUT (FORMAT BINARY)
+        ;""", {"type": type.lower() if type else None,
+               "species": species.lower() if species else None}).decode()
+    buffer = BytesIO()
+    cur.copy_expert(query, buffer)
+    cur.close()
+    return buffer.getbuffer()
+
+
+@db_breaker
+def get_species_names(conn) -> dict[int, str]:
+    """Returns species names keyed by id."""
+    cur = tuple_cursor(conn)
+    timed_execute(cur, "SELECT species_id, species_name FROM species;")
+    species = dict(cur.fetchall())
     cur.close()
-    return experiment
+    return species
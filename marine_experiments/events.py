@@ -0,0 +1,111 @@
+"""Fans experiment change notifications out to Server-Sent Events clients."""
+
+import json
+from queue import Queue, Empty, Full
+from select import select
+from threading import Thread, Lock, Event
+from time import sleep
+
+from psycopg2 import OperationalError, InterfaceError
+
+from resilience import connect_with_backoff
+
+
+CHANNEL = "experiment_events"
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_BUFFER = 100
+
+
+def format_event(event: dict) -> str:
+    """Returns a change notification as a Server-Sent Events message."""
+    return f"event: {event['event']}\ndata: {json.dumps(event['experiment'])}\n\n"
+
+
+class EventBroadcaster:
+    """Listens for change notifications on one connection and copies them to every subscriber.
+
+    The listener thread and its connection are only started when the first
+    client subscribes, so the API opens no extra connection unless events are used."""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.subscribers = set()
+        self.lock = Lock()
+        self.stopping = Event()
+        self.ready = Event()
+        self.thread = None
+
+    def subscribe(self) -> Queue:
+        """Returns a queue that receives every future event."""
+        subscriber = Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = Thread(target=self.listen, daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Queue) -> None:
+        """Stops sending events to a subscriber."""
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event: dict) -> None:
+        """Sends an event to every subscriber, dropping any that have stopped reading."""
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(event)
+                except Full:
+                    self.subscribers.discard(subscriber)
+
+    def listen(self) -> None:
+        """Relays notifications until stopped, reconnecting if the connection drops."""
+        while not self.stopping.is_set():
+            try:
+                conn = connect_with_backoff(self.connect)
+            except OperationalError:
+                sleep(1)
+                continue
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL};")
+                self.ready.set()
+                while not self.stopping.is_set():
+                    if select([conn], [], [], 1) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.publish(json.loads(conn.notifies.pop(0).payload))
+            except (OperationalError, InterfaceError):
+                continue
+            finally:
+                self.ready.clear()
+                conn.close()
+
+    def stop(self) -> None:
+        """Stops the listener thread and closes its connection."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+
+
+def stream_events(broadcaster: EventBroadcaster):
+    """Yields Server-Sent Events messages for one client until it disconnects."""
+    subscriber = broadcaster.subscribe()
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = subscriber.get(timeout=HEARTBEAT_SECONDS)
+            except Empty:
+                if subscriber not in broadcaster.subscribers:
+                    return
+                yield ": heartbeat\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
@@ -0,0 +1,24 @@
+"""Gunicorn settings for running the API in production."""
+
+import os
+from multiprocessing import cpu_count
+
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", cpu_count() * 2 + 1))
+# Threaded workers: an open /experiment/events stream holds one thread rather than a
+# whole worker, and the worker's heartbeat does not depend on any one request, so
+# timeout no longer cuts long-lived streams off.
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 32))
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Each worker must import the app itself so that it opens its own database
+# connection after fork; a preloaded app would share one socket between workers.
+preload_app = False
+
+# Recycle workers periodically to bound memory growth.
+max_requests = 1000
+max_requests_jitter = 100
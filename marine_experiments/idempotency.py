@@ -0,0 +1,55 @@
+"""Support for Idempotency-Key headers, so client retries are answered from a stored response."""
+
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+IDEMPOTENCY_TTL = 24 * 60 * 60
+MAX_KEY_LENGTH = 255
+
+
+def hash_request(body) -> str:
+    """Returns a stable fingerprint of a JSON request body."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """A least-recently-used cache of stored responses whose entries expire after ttl seconds.
+
+    It sits in front of the idempotency_key table so a retry landing on the same
+    worker is answered without a database round-trip."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = IDEMPOTENCY_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: str) -> tuple | None:
+        """Returns the (request hash, response) for a key, or None if absent or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: tuple) -> None:
+        """Stores a value, evicting the least recently used entry if full."""
+        with self.lock:
+            self.entries[key] = (monotonic(), value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forgets every entry."""
+        with self.lock:
+            self.entries.clear()
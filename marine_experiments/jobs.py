@@ -0,0 +1,157 @@
+"""Runs long exports and aggregations in worker processes, off the request path.
+
+Job state lives in files so that any API worker can report on any job:
+`<job_id>.job` holds the status and `<job_id>.json` the finished result.
+Each job records the pid of the API worker that queued it and of the process
+running it, so a job whose process has exited without finishing it is reported
+as failed instead of staying queued or running forever."""
+
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from time import time
+from uuid import uuid4
+
+from database_functions import get_db_connection, iter_experiments, get_score_aggregates
+
+
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), "marine_experiment_jobs"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_KINDS = ("export", "aggregation")
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 86400))
+
+_pool = None
+
+
+def job_path(job_id: str, extension: str, job_dir: str = None) -> str:
+    """Returns the path of one of a job's files."""
+    return os.path.join(job_dir or JOB_DIR, f"{job_id}.{extension}")
+
+
+def is_job_id(job_id: str) -> bool:
+    """Checks that a job id is a uuid4 hex string, so it is safe to use in a path."""
+    return len(job_id) == 32 and all(c in "0123456789abcdef" for c in job_id)
+
+
+def write_atomically(path: str, write) -> None:
+    """Calls write(file) on a temporary file, then moves it into place."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+def update_job(job_dir: str, job: dict, **changes) -> dict:
+    """Saves a job's metadata with the given fields changed."""
+    job = {**job, **changes}
+    write_atomically(job_path(job["job_id"], "job", job_dir), lambda f: json.dump(job, f))
+    return job
+
+
+def write_export(conn, params: dict, f) -> None:
+    """Streams matching experiments to f as a JSON array."""
+    f.write("[")
+    first = True
+    for batch in iter_experiments(params.get("type"), params.get("score_over"), conn):
+        for experiment in batch:
+            f.write("" if first else ",")
+            json.dump(experiment, f)
+            first = False
+    f.write("]")
+
+
+def write_aggregation(conn, params: dict, f) -> None:
+    """Writes per-species, per-type score aggregates of matching experiments to f."""
+    json.dump(get_score_aggregates(params.get("type"), params.get("score_over"), conn), f)
+
+
+WRITERS = {"export": write_export, "aggregation": write_aggregation}
+
+
+def run_job(job: dict, database: str, job_dir: str) -> None:
+    """Runs a job in a worker process on a connection of its own."""
+    job = update_job(job_dir, job, status="running", runner_pid=os.getpid())
+    conn = None
+    try:
+        conn = get_db_connection(database)
+        write_atomically(job_path(job["job_id"], "json", job_dir),
+                         lambda f: WRITERS[job["kind"]](conn, job["params"], f))
+    except Exception as error:
+        update_job(job_dir, job, status="failed", error=str(error),
+                   finished_at=datetime.now(timezone.utc).isoformat())
+        return
+    finally:
+        if conn is not None:
+            conn.close()
+    update_job(job_dir, job, status="done",
+               finished_at=datetime.now(timezone.utc).isoformat())
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Returns the worker pool, starting it on first use.
+
+    Workers are spawned rather than forked so they never inherit the API's connection."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=get_context("spawn"))
+    return _pool
+
+
+def is_running(pid: int) -> bool:
+    """Checks whether a process with the given pid still exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def expire_jobs(job_dir: str = None, max_age: float = None) -> None:
+    """Deletes job files that have not changed for max_age seconds."""
+    job_dir = job_dir or JOB_DIR
+    cutoff = time() - (JOB_RETENTION_SECONDS if max_age is None else max_age)
+    for entry in os.scandir(job_dir):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def submit_job(kind: str, params: dict, database: str) -> dict:
+    """Records a new job and queues it for a worker, first deleting expired jobs."""
+    os.makedirs(JOB_DIR, exist_ok=True)
+    expire_jobs()
+    job = update_job(JOB_DIR, {
+        "job_id": uuid4().hex,
+        "kind": kind,
+        "params": params,
+        "status": "queued",
+        "owner_pid": os.getpid(),
+        "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    get_pool().submit(run_job, job, database, JOB_DIR)
+    return job
+
+
+def get_job(job_id: str) -> dict | None:
+    """Returns a job's metadata, or None if there is no such job.
+
+    A job whose queueing or running process has exited is marked failed."""
+    if not is_job_id(job_id):
+        return None
+    try:
+        with open(job_path(job_id, "job"), encoding="utf-8") as f:
+            job = json.load(f)
+    except FileNotFoundError:
+        return None
+    pid = {"queued": job.get("owner_pid"), "running": job.get("runner_pid")}.get(job["status"])
+    if pid is not None and not is_running(pid):
+        job = update_job(JOB_DIR, job, status="failed", error="Job worker exited before finishing.",
+                         finished_at=datetime.now(timezone.utc).isoformat())
+    return job
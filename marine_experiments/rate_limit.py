@@ -0,0 +1,76 @@
+"""Token-bucket rate limiting, charged per request by route cost."""
+
+from threading import Lock
+from time import monotonic
+
+
+class MemoryBucketStore:
+    """Keeps token buckets in process memory.
+
+    Any object with the same take() and reset() methods can be used instead,
+    e.g. one backed by a shared cache so several workers see the same buckets.
+    Every sweep_interval seconds, buckets that have refilled completely are dropped;
+    a full bucket is the same as no bucket, so idle clients cost no memory."""
+
+    def __init__(self, sweep_interval: float = 60):
+        self.buckets = {}
+        self.lock = Lock()
+        self.sweep_interval = sweep_interval
+        self.swept_at = monotonic()
+
+    def take(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        """Takes cost tokens from the key's bucket.
+
+        Returns 0 if they were taken, otherwise the seconds until they will be available."""
+        now = monotonic()
+        with self.lock:
+            if now - self.swept_at >= self.sweep_interval:
+                self.sweep(now, capacity, refill_rate)
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            if tokens >= cost:
+                self.buckets[key] = (tokens - cost, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (cost - tokens) / refill_rate
+
+    def sweep(self, now: float, capacity: float, refill_rate: float) -> None:
+        """Drops buckets that would be full by now; the caller holds the lock."""
+        self.buckets = {key: (tokens, updated_at) for key, (tokens, updated_at) in self.buckets.items()
+                        if tokens + (now - updated_at) * refill_rate < capacity}
+        self.swept_at = now
+
+    def reset(self) -> None:
+        """Refills every bucket."""
+        with self.lock:
+            self.buckets.clear()
+
+
+class RateLimiter:
+    """Charges each client for the routes they call against a token bucket."""
+
+    def __init__(self, costs: dict, store=None, capacity: float = 100,
+                 refill_rate: float = 10, default_cost: float = 1):
+        self.costs = costs
+        self.store = store if store is not None else MemoryBucketStore()
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.default_cost = default_cost
+
+    def cost_of(self, method: str, endpoint: str | None) -> float:
+        """Returns the token cost of a route, capped at the bucket size."""
+        return min(self.costs.get((method, endpoint), self.default_cost), self.capacity)
+
+    def check(self, client: str, method: str, endpoint: str | None) -> float:
+        """Returns 0 if the client may proceed, otherwise the seconds to wait."""
+        return self.charge(client, self.cost_of(method, endpoint))
+
+    def charge(self, client: str, cost: float) -> float:
+        """Takes an explicit cost, capped at the bucket size, from the client's bucket.
+
+        Returns 0 if the client may proceed, otherwise the seconds to wait."""
+        return self.store.take(client, min(cost, self.capacity), self.capacity, self.refill_rate)
+
+    def reset(self) -> None:
+        """Forgets every client's usage."""
+        self.store.reset()
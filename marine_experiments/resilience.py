@@ -0,0 +1,90 @@
+"""Keeps a single bad request or a dropped connection from taking the API down."""
+
+from functools import wraps
+from time import monotonic, sleep
+
+from psycopg2 import OperationalError, InterfaceError
+from psycopg2.extensions import connection, TRANSACTION_STATUS_IDLE
+
+
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the database while the circuit is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Database temporarily unavailable.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling the database after repeated connection failures.
+
+    After `threshold` consecutive failures the circuit opens and calls fail fast
+    for `reset_after` seconds; the next call is then let through as a trial."""
+
+    def __init__(self, threshold: int = 5, reset_after: float = 10):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError if the circuit is open."""
+        if self.opened_at is None:
+            return
+        remaining = self.reset_after - (monotonic() - self.opened_at)
+        if remaining > 0:
+            raise CircuitOpenError(remaining)
+
+    def record_success(self) -> None:
+        """Closes the circuit."""
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        """Counts a failure, opening the circuit once the threshold is reached."""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = monotonic()
+
+    def reset(self) -> None:
+        """Forgets every failure."""
+        self.record_success()
+
+    def __call__(self, func):
+        """Wraps a database function so connection errors count against the circuit."""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except CONNECTION_ERRORS:
+                self.record_failure()
+                raise
+            self.record_success()
+            return result
+        return wrapper
+
+
+def connect_with_backoff(connect, attempts: int = 4, delay: float = 0.1) -> connection:
+    """Calls connect() until it succeeds, doubling the delay after each failure."""
+    for attempt in range(attempts):
+        try:
+            return connect()
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            sleep(delay * 2 ** attempt)
+
+
+def end_transaction(conn: connection) -> None:
+    """Rolls back anything a request left open so the next one starts clean."""
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except CONNECTION_ERRORS:
+        pass
@@ -1,3 +1,9 @@
+DROP TABLE IF EXISTS idempotency_key;
+
+DROP TABLE IF EXISTS experiment_change;
+
+DROP TABLE IF EXISTS experiment_archive;
+
 DROP TABLE IF EXISTS experiment;
 
 DROP TABLE IF EXISTS subject;
@@ -6,6 +12,8 @@ DROP TABLE IF EXISTS experiment_type;
 
 DROP TABLE IF EXISTS species;
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TABLE species (
     species_id INT GENERATED ALWAYS AS IDENTITY,
     species_name TEXT NOT NULL,
@@ -24,6 +32,14 @@ CREATE TABLE subject (
     FOREIGN KEY (species_id) REFERENCES species (species_id)
 );
 
+CREATE INDEX subject_name_prefix_idx ON subject (lower(subject_name) text_pattern_ops);
+
+CREATE INDEX subject_name_trgm_idx ON subject USING GIN (subject_name gin_trgm_ops);
+
+CREATE INDEX species_name_trgm_idx ON species USING GIN (species_name gin_trgm_ops);
+
+CREATE INDEX subject_species_id_idx ON subject (species_id, subject_name);
+
 CREATE TABLE experiment_type (
     experiment_type_id INT GENERATED ALWAYS AS IDENTITY,
     type_name TEXT NOT NULL UNIQUE,
@@ -37,11 +53,136 @@ CREATE TABLE experiment (
     experiment_type_id INT NOT NULL,
     experiment_date DATE DEFAULT CURRENT_TIMESTAMP,
     score DECIMAL NOT NULL,
+    score_percentage DECIMAL,
     PRIMARY KEY (experiment_id),
     FOREIGN KEY (subject_id) REFERENCES subject (subject_id),
     FOREIGN KEY (experiment_type_id) REFERENCES experiment_type (experiment_type_id)
 );
 
+CREATE INDEX experiment_date_idx ON experiment (experiment_date, experiment_id);
+
+CREATE INDEX experiment_score_percentage_idx ON experiment (score_percentage);
+
+CREATE TABLE experiment_archive (
+    experiment_id INT NOT NULL,
+    subject_id INT NOT NULL,
+    experiment_type_id INT NOT NULL,
+    experiment_date DATE NOT NULL,
+    score DECIMAL NOT NULL,
+    score_percentage DECIMAL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMPTZ,
+    PRIMARY KEY (experiment_id),
+    FOREIGN KEY (subject_id) REFERENCES subject (subject_id),
+    FOREIGN KEY (experiment_type_id) REFERENCES experiment_type (experiment_type_id)
+);
+
+CREATE TABLE experiment_change (
+    change_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    experiment_id INT NOT NULL,
+    operation TEXT NOT NULL CHECK (operation IN ('insert', 'update', 'delete')),
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    PRIMARY KEY (change_id)
+);
+
+CREATE INDEX experiment_change_experiment_id_idx ON experiment_change (experiment_id, change_id);
+
+CREATE INDEX experiment_change_xid_idx ON experiment_change (xid, change_id);
+
+CREATE TABLE idempotency_key (
+    client TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    response JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (client, idempotency_key)
+);
+
+CREATE INDEX idempotency_key_created_at_idx ON idempotency_key (created_at);
+
+CREATE OR REPLACE FUNCTION set_score_percentage() RETURNS TRIGGER AS $$
+BEGIN
+    SELECT NEW.score / NULLIF(max_score, 0) * 100 INTO NEW.score_percentage
+    FROM experiment_type
+    WHERE experiment_type_id = NEW.experiment_type_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiment_score_percentage
+BEFORE INSERT OR UPDATE OF score, experiment_type_id ON experiment
+FOR EACH ROW EXECUTE FUNCTION set_score_percentage();
+
+CREATE OR REPLACE FUNCTION rescale_score_percentages() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM set_config('marine.rescaling', 'on', TRUE);
+    UPDATE experiment
+    SET score_percentage = score / NULLIF(NEW.max_score, 0) * 100
+    WHERE experiment_type_id = NEW.experiment_type_id;
+    UPDATE experiment_archive
+    SET score_percentage = score / NULLIF(NEW.max_score, 0) * 100
+    WHERE experiment_type_id = NEW.experiment_type_id;
+    INSERT INTO experiment_change (experiment_id, operation)
+    SELECT experiment_id, 'update'
+    FROM experiment_archive
+    WHERE experiment_type_id = NEW.experiment_type_id
+    AND deleted_at IS NULL;
+    PERFORM set_config('marine.rescaling', 'off', TRUE);
+    PERFORM pg_notify('experiment_events', json_build_object(
+        'event', 'rescale',
+        'experiment', json_build_object(
+            'experiment_type_id', NEW.experiment_type_id,
+            'experiment_type', NEW.type_name,
+            'max_score', NEW.max_score
+        )
+    )::TEXT);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiment_type_max_score
+AFTER UPDATE OF max_score ON experiment_type
+FOR EACH ROW WHEN (OLD.max_score IS DISTINCT FROM NEW.max_score)
+EXECUTE FUNCTION rescale_score_percentages();
+
+CREATE OR REPLACE FUNCTION archive_experiment() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO experiment_archive (experiment_id, subject_id, experiment_type_id, experiment_date, score, score_percentage, deleted_at)
+    VALUES (OLD.experiment_id, OLD.subject_id, OLD.experiment_type_id, OLD.experiment_date, OLD.score, OLD.score_percentage,
+            CASE WHEN current_setting('marine.archiving', TRUE) = 'on' THEN NULL ELSE CURRENT_TIMESTAMP END);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiment_archive_copy
+AFTER DELETE ON experiment
+FOR EACH ROW EXECUTE FUNCTION archive_experiment();
+
+CREATE OR REPLACE FUNCTION log_experiment_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('marine.archiving', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO experiment_change (experiment_id, operation) VALUES (NEW.experiment_id, 'insert');
+        RETURN NEW;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW IS DISTINCT FROM OLD THEN
+            INSERT INTO experiment_change (experiment_id, operation) VALUES (NEW.experiment_id, 'update');
+        END IF;
+        RETURN NEW;
+    END IF;
+    INSERT INTO experiment_change (experiment_id, operation) VALUES (OLD.experiment_id, 'delete');
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiment_change_log
+AFTER INSERT OR UPDATE OR DELETE ON experiment
+FOR EACH ROW EXECUTE FUNCTION log_experiment_change();
+
 INSERT INTO experiment_type
     (type_name, max_score)
 VALUES
@@ -84,3 +225,59 @@ VALUES
     (4, 3, '2024-02-10', 10),
     (5, 2, '2024-02-12', 6)
 ;
+
+
+CREATE OR REPLACE FUNCTION notify_experiment_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('marine.archiving', TRUE) = 'on' OR current_setting('marine.rescaling', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW IS NOT DISTINCT FROM OLD THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('experiment_events', json_build_object(
+            'event', lower(TG_OP),
+            'experiment', json_build_object(
+                'experiment_id', NEW.experiment_id,
+                'subject_id', NEW.subject_id,
+                'experiment_type_id', NEW.experiment_type_id,
+                'experiment_date', to_char(NEW.experiment_date, 'YYYY-MM-DD'),
+                'score', NEW.score
+            )
+        )::TEXT);
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('experiment_events', json_build_object(
+        'event', 'delete',
+        'experiment', json_build_object(
+            'experiment_id', OLD.experiment_id,
+            'experiment_date', to_char(OLD.experiment_date, 'YYYY-MM-DD')
+        )
+    )::TEXT);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiment_change_notify
+AFTER INSERT OR UPDATE OR DELETE ON experiment
+FOR EACH ROW EXECUTE FUNCTION notify_experiment_change();
+
+CREATE OR REPLACE FUNCTION log_archived_experiment_delete() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO experiment_change (experiment_id, operation) VALUES (NEW.experiment_id, 'delete');
+    PERFORM pg_notify('experiment_events', json_build_object(
+        'event', 'delete',
+        'experiment', json_build_object(
+            'experiment_id', NEW.experiment_id,
+            'experiment_date', to_char(NEW.experiment_date, 'YYYY-MM-DD')
+        )
+    )::TEXT);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiment_archive_delete_log
+AFTER UPDATE OF deleted_at ON experiment_archive
+FOR EACH ROW WHEN (OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL)
+EXECUTE FUNCTION log_archived_experiment_delete();
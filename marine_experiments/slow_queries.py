@@ -0,0 +1,101 @@
+"""Opt-in recording of slow queries and their plans.
+
+Set SLOW_QUERY_MS to enable it. Any query slower than the threshold is logged
+with its parameters, duration and row count, and its plan is captured once per
+query shape. Reads are explained with ANALYZE; writes are only EXPLAINed, so
+they are never run twice."""
+
+import logging
+import os
+import re
+from collections import deque
+from datetime import datetime, timezone
+from threading import Lock
+from time import perf_counter
+
+from psycopg2 import Error
+from psycopg2.extensions import cursor
+
+
+MAX_RECORDED = 100
+
+logger = logging.getLogger(__name__)
+
+threshold_ms = float(os.environ["SLOW_QUERY_MS"]) if os.environ.get("SLOW_QUERY_MS") else None
+recorded = deque(maxlen=MAX_RECORDED)
+plans = {}
+_lock = Lock()
+
+
+def configure(threshold: float | None) -> None:
+    """Sets the slow query threshold in milliseconds; None turns recording off."""
+    global threshold_ms
+    threshold_ms = threshold
+
+
+def clear() -> None:
+    """Forgets recorded queries and plans."""
+    with _lock:
+        recorded.clear()
+        plans.clear()
+
+
+def query_shape(query: str) -> str:
+    """Returns the query with whitespace collapsed, used to group executions."""
+    return " ".join(query.split())
+
+
+def explain(cur: cursor, query: str, params) -> str:
+    """Returns the plan for a query, inside a savepoint so a failure cannot abort the caller."""
+    is_read = re.match(r"\s*(SELECT|WITH)\b", query, re.IGNORECASE) is not None
+    options = "ANALYZE, BUFFERS" if is_read else "COSTS"
+    explain_cur = cur.connection.cursor(cursor_factory=cursor)
+    try:
+        explain_cur.execute("SAVEPOINT slow_query_explain;")
+        try:
+            explain_cur.execute(f"EXPLAIN ({options}) {query}", params)
+            plan = "\n".join(line for (line,) in explain_cur.fetchall())
+        except Error as error:
+            plan = f"EXPLAIN failed: {error}"
+        explain_cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain;")
+    finally:
+        explain_cur.close()
+    return plan
+
+
+def timed_execute(cur: cursor, query: str, params=None) -> None:
+    """Executes a query, recording it if it is slower than the threshold."""
+    if threshold_ms is None:
+        cur.execute(query, params)
+        return
+    start = perf_counter()
+    cur.execute(query, params)
+    duration_ms = (perf_counter() - start) * 1000
+    if duration_ms < threshold_ms:
+        return
+
+    shape = query_shape(query)
+    logger.warning("Slow query (%.1f ms, %s rows): %s %r", duration_ms, cur.rowcount, shape, params)
+    if shape not in plans and not cur.connection.autocommit:
+        plan = explain(cur, query, params)
+        with _lock:
+            plans.setdefault(shape, plan)
+    with _lock:
+        recorded.append({
+            "query": shape,
+            "params": ({key: str(value) for key, value in params.items()} if isinstance(params, dict)
+                       else [str(param) for param in params or []]),
+            "duration_ms": round(duration_ms, 2),
+            "rows": cur.rowcount,
+            "recorded_at": datetime.now(timezone.utc).isoformat()
+            })
+
+
+def report() -> dict:
+    """Returns the recorded slow queries, newest first, with their plans."""
+    with _lock:
+        return {
+            "threshold_ms": threshold_ms,
+            "queries": list(reversed(recorded)),
+            "plans": dict(plans)
+            }
@@ -0,0 +1,133 @@
+"""Validation of request bodies before they reach the database."""
+
+import re
+from datetime import datetime
+from time import monotonic
+
+from database_functions import get_subject_ids, get_experiment_types
+
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+SUBJECT_CACHE_TTL = 5
+EXPERIMENT_TYPE_CACHE_TTL = 60
+
+REQUIRED_EXPERIMENT_KEYS = ("score", "experiment_type", "subject_id")
+
+
+class LookupCache:
+    """Subject ids and experiment types cached for one database."""
+
+    def __init__(self):
+        self.subject_ids = set()
+        self.subject_ids_loaded_at = None
+        self.experiment_types = {}
+        self.experiment_types_loaded_at = None
+
+
+_caches = {}
+
+
+def invalid(key: str) -> dict:
+    """Returns the error body for an invalid value."""
+    return {"error": f"Invalid value for '{key}' parameter."}
+
+
+def as_int(value) -> int | None:
+    """Returns the value as an int, or None if it is not a whole number."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
+
+def is_valid_date(value) -> bool:
+    """Returns True if the value is a real date in YYYY-MM-DD format."""
+    if not isinstance(value, str) or not DATE_PATTERN.fullmatch(value):
+        return False
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return False
+    return True
+
+
+def lookup_cache(namespace: str = "") -> LookupCache:
+    """Returns the cache for a namespace; each facility database has its own."""
+    return _caches.setdefault(namespace, LookupCache())
+
+
+def load_experiment_types(conn, namespace: str = "") -> dict:
+    """Returns the cached experiment types, reloading them once they are older than the TTL.
+
+    The reload replaces the dict rather than refilling it, so concurrent readers never see it empty."""
+    cache = lookup_cache(namespace)
+    if (cache.experiment_types_loaded_at is None
+            or monotonic() - cache.experiment_types_loaded_at > EXPERIMENT_TYPE_CACHE_TTL):
+        cache.experiment_types = get_experiment_types(conn)
+        cache.experiment_types_loaded_at = monotonic()
+    return cache.experiment_types
+
+
+def forget_experiment_types(namespace: str = "") -> None:
+    """Makes the next validation reload experiment types, e.g. after max_score changed."""
+    lookup_cache(namespace).experiment_types_loaded_at = None
+
+
+def subject_exists(subject_id: int, conn, namespace: str = "") -> bool:
+    """Checks a subject id against the cached set, refreshing it on a stale miss."""
+    cache = lookup_cache(namespace)
+    if subject_id in cache.subject_ids:
+        return True
+    if (cache.subject_ids_loaded_at is None
+            or monotonic() - cache.subject_ids_loaded_at > SUBJECT_CACHE_TTL):
+        cache.subject_ids.clear()
+        cache.subject_ids.update(get_subject_ids(conn))
+        cache.subject_ids_loaded_at = monotonic()
+    return subject_id in cache.subject_ids
+
+
+def warm_caches(conn, namespace: str = "") -> None:
+    """Loads every cached lookup ahead of the first request."""
+    cache = lookup_cache(namespace)
+    load_experiment_types(conn, namespace)
+    cache.subject_ids.update(get_subject_ids(conn))
+    cache.subject_ids_loaded_at = monotonic()
+
+
+def clear_caches() -> None:
+    """Forgets all cached lookups."""
+    _caches.clear()
+
+
+def validate_experiment(data: dict, conn, namespace: str = "") -> dict | None:
+    """Returns an error body if the experiment is invalid, otherwise None.
+
+    Checks run cheapest first; the subject lookup only runs on an otherwise valid body."""
+    for key in REQUIRED_EXPERIMENT_KEYS:
+        if data.get(key) is None:
+            return {"error": f"Request missing key '{key}'."}
+
+    subject_id = as_int(data["subject_id"])
+    if subject_id is None or subject_id < 1:
+        return invalid("subject_id")
+
+    experiment_type = data["experiment_type"]
+    experiment_types = load_experiment_types(conn, namespace)
+    if not isinstance(experiment_type, str) or experiment_type.lower() not in experiment_types:
+        return invalid("experiment_type")
+
+    score = as_int(data["score"])
+    max_score = experiment_types[experiment_type.lower()]["max_score"]
+    if score is None or not 0 <= score <= max_score:
+        return invalid("score")
+
+    experiment_date = data.get("experiment_date")
+    if experiment_date is not None and not is_valid_date(experiment_date):
+        return invalid("experiment_date")
+
+    if not subject_exists(subject_id, conn, namespace):
+        return invalid("subject_id")
+    return None
@@ -0,0 +1,18 @@
+"""Production entry point.
+
+Run with: gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+"""
+
+from flask import Flask
+
+import api
+
+
+def create_app(warm: bool = True) -> Flask:
+    """Returns the API ready to serve.
+
+    Importing the api module opens no connection; warming up opens this
+    process's connection and fills its caches before the first request arrives."""
+    if warm:
+        api.warm_up()
+    return api.app